@@ -1,13 +1,260 @@
-# app.py
+# streamlit_app.py
+import httpx
 import streamlit as st
-from elevenlabs import ElevenLabs
-import tempfile
+from elevenlabs import AsyncElevenLabs, ElevenLabs
+import re
+import asyncio
+import hashlib
+import threading
+import io
 import os
+import numpy as np
+import pandas as pd
+import soundfile as sf
+from scipy.signal import resample_poly
 
 # ---------------------------------------------------------
 # Initialize ElevenLabs client
 # ---------------------------------------------------------
-client = ElevenLabs(api_key=st.secrets["ELEVENLABS_KEY"])
+@st.cache_resource
+def get_client():
+    """Build the ElevenLabs client once per process and share it across sessions and reruns."""
+    # One keep-alive HTTP/2 connection shared by every SDK call, so requests after
+    # the first skip the TCP + TLS handshake and can be multiplexed
+    http_client = httpx.Client(
+        timeout=30,
+        transport=httpx.HTTPTransport(
+            http2=True,
+            retries=2,
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=10),
+        ),
+    )
+    return ElevenLabs(api_key=st.secrets["ELEVENLABS_KEY"], httpx_client=http_client, timeout=30)
+
+
+client = get_client()
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def list_voices():
+    """Return all voices as plain dicts, cached so reruns don't refetch them."""
+    return client.voices.get_all().model_dump()["voices"]
+
+
+# Clone samples are downmixed and downsampled to this rate before upload
+SAMPLE_RATE = 16000
+# WAV encodings already no larger than the 16-bit PCM we would re-encode to
+COMPACT_SUBTYPES = {"PCM_U8", "PCM_S8", "PCM_16", "ULAW", "ALAW"}
+
+
+def prepare_sample(uploaded_file):
+    """Return a (name, content, type) upload part, shrinking larger WAV samples to 16 kHz mono first."""
+    # Rewind in case an earlier rerun already consumed the upload
+    uploaded_file.seek(0)
+    # Compressed uploads are already small; decoding them to PCM would only grow them
+    if not uploaded_file.name.lower().endswith(".wav"):
+        return (uploaded_file.name, uploaded_file, uploaded_file.type or "audio/mpeg")
+
+    with sf.SoundFile(uploaded_file) as f:
+        channels, sr, subtype = f.channels, f.samplerate, f.subtype
+        data = f.read()
+    if data.ndim == 2:
+        data = data.mean(axis=1)
+    peak = np.abs(data).max(initial=0.0)
+    if peak == 0:
+        raise ValueError("The uploaded sample is silent.")
+    if peak >= 0.999:
+        st.warning("The uploaded sample is clipped; the cloned voice may sound distorted.")
+    # Re-encoding a file that is already small would only make it bigger
+    if channels == 1 and sr <= SAMPLE_RATE and subtype in COMPACT_SUBTYPES:
+        uploaded_file.seek(0)
+        return (uploaded_file.name, uploaded_file, uploaded_file.type or "audio/wav")
+    if sr > SAMPLE_RATE:
+        data = resample_poly(data, SAMPLE_RATE, sr)
+        sr = SAMPLE_RATE
+
+    buf = io.BytesIO()
+    # Resampling can overshoot near full scale; libsndfile would wrap, not clip
+    sf.write(buf, np.clip(data, -1.0, 1.0).astype(np.float32), sr, format="WAV", subtype="PCM_16")
+    return (f"{os.path.splitext(uploaded_file.name)[0]}.wav", buf.getvalue(), "audio/wav")
+
+
+DEFAULT_MODEL = "eleven_flash_v2_5"
+MODELS = {
+    "flash (fast)": DEFAULT_MODEL,
+    "multilingual_v2 (quality)": "eleven_multilingual_v2",
+}
+
+# Speech is narrowband, so low bitrates cost little quality and download
+# several times fewer bytes than studio MP3
+DEFAULT_FORMAT = "mp3_22050_32"
+OUTPUT_FORMATS = {
+    "voice agent (mp3_22050_32)": DEFAULT_FORMAT,
+    "telephone (ulaw_8000)": "ulaw_8000",
+    "studio (mp3_44100_128)": "mp3_44100_128",
+}
+
+
+def tts_request(text, voice, model=None, output_format=None):
+    """Keyword arguments shared by every text-to-speech call."""
+    return dict(
+        voice_id=voice,
+        text=text,
+        model_id=model or DEFAULT_MODEL,
+        optimize_streaming_latency=3,
+        output_format=output_format or DEFAULT_FORMAT,
+    )
+
+
+def synthesize_stream(text, voice, model=None, output_format=None):
+    """Yield audio chunks from the streaming TTS endpoint as they arrive."""
+    yield from client.text_to_speech.stream(**tts_request(text, voice, model, output_format))
+
+
+# Memory budget for synthesized clips kept in process, so repeats and reruns
+# skip the API call
+AUDIO_CACHE_BYTES = 64 * 1024 * 1024
+
+
+@st.cache_resource
+def _audio_cache():
+    """Process-wide store of synthesized clips, keyed by (text, voice, model, format)."""
+    return {}
+
+
+@st.cache_resource
+def _audio_cache_lock():
+    """Lock guarding _audio_cache, which every session thread shares."""
+    return threading.Lock()
+
+
+def remember_clip(key, audio_bytes):
+    """Store a finished clip, evicting the oldest ones past AUDIO_CACHE_BYTES."""
+    cache = _audio_cache()
+    with _audio_cache_lock():
+        cache.setdefault(key, audio_bytes)
+        total = sum(len(clip) for clip in cache.values())
+        while cache and total > AUDIO_CACHE_BYTES:
+            total -= len(cache.pop(next(iter(cache))))
+
+
+def render_clip(audio_bytes, output_format=None, container=st, part=None, autoplay=False):
+    """Play MP3 clips inline; offer raw telephony audio as a download, numbered by part."""
+    output_format = output_format or DEFAULT_FORMAT
+    if output_format.startswith("mp3"):
+        container.audio(audio_bytes, format="audio/mpeg", autoplay=autoplay)
+    else:
+        # Browsers can't play headerless u-law, so hand the file over instead
+        extension = output_format.split("_")[0]
+        suffix = "" if part is None else f"-{part}"
+        container.download_button(
+            "Download audio" if part is None else f"Download part {part}",
+            audio_bytes,
+            file_name=f"agent{suffix}.{extension}",
+            key=f"clip{suffix}-{hashlib.sha1(audio_bytes).hexdigest()}",
+        )
+
+
+def play_audio(text, voice, model=None, output_format=None):
+    """Play a clip from cache, or stream and cache it, starting playback as soon as it is complete."""
+    key = (text, voice, model, output_format)
+    st.session_state["last_audio"] = [key]
+    audio_bytes = _audio_cache().get(key)
+    if audio_bytes is None:
+        buf = io.BytesIO()
+        with st.spinner("Synthesizing..."):
+            for chunk in synthesize_stream(text, voice, model, output_format):
+                buf.write(chunk)
+        audio_bytes = buf.getvalue()
+        remember_clip(key, audio_bytes)
+    render_clip(audio_bytes, output_format, autoplay=True)
+
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+# In-flight TTS requests per run; ElevenLabs rejects requests beyond the
+# plan's concurrency limit instead of queueing them
+MAX_CONCURRENT_TTS = 4
+
+
+async def _synthesize_async(aclient, text, voice, model=None, output_format=None):
+    """Synthesize one sentence with the async client and return its audio bytes."""
+    request = tts_request(text, voice, model, output_format)
+    chunks = [chunk async for chunk in aclient.text_to_speech.convert(**request)]
+    return b"".join(chunks)
+
+
+async def pipeline(sentences, voice, model=None, output_format=None):
+    """Synthesize sentences concurrently and play each one, in order, as soon as it is ready."""
+    # The async client is bound to the event loop, so it lives for one run only
+    async with httpx.AsyncClient(http2=True, timeout=30) as http:
+        aclient = AsyncElevenLabs(api_key=st.secrets["ELEVENLABS_KEY"], httpx_client=http, timeout=30)
+        limit = asyncio.Semaphore(MAX_CONCURRENT_TTS)
+
+        async def synthesize(sentence):
+            async with limit:
+                return await _synthesize_async(aclient, sentence, voice, model, output_format)
+
+        keys = [(sentence, voice, model, output_format) for sentence in sentences]
+        st.session_state["last_audio"] = keys
+        cache = _audio_cache()
+        clips = {key: cache.get(key) for key in keys}
+        # Queue one request per distinct uncached sentence up front; the pool keeps
+        # MAX_CONCURRENT_TTS in flight, so N misses cost about
+        # ceil(N / MAX_CONCURRENT_TTS) round trips
+        tasks = {
+            key: asyncio.create_task(synthesize(key[0]))
+            for key, audio_bytes in clips.items()
+            if audio_bytes is None
+        }
+        try:
+            for part, key in enumerate(keys, start=1):
+                if clips[key] is None:
+                    clips[key] = await tasks[key]
+                    remember_clip(key, clips[key])
+                # Start the first sentence without a click while the rest synthesize
+                render_clip(clips[key], output_format, part=part, autoplay=part == 1)
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+
+def render_voices_panel(voices):
+    """Show the voice list as a single table."""
+    df = pd.DataFrame(
+        [{"name": v["name"], "voice_id": v["voice_id"], "category": v["category"]} for v in voices]
+    )
+    st.dataframe(df, hide_index=True)
+
+
+# A fragment reruns on its own, so editing the script or generating speech
+# doesn't re-execute the rest of the page
+@st.fragment
+def render_deploy_panel(voice_map, model, output_format):
+    """Voice picker, script editor and playback for Deploy Agent."""
+    selected = st.selectbox("Choose Agent Voice", list(voice_map.keys()))
+    text_input = st.text_area("Agent Script", "Hello! I am your AI agent.")
+    by_sentence = st.checkbox("Speak sentence by sentence")
+
+    if st.button("Generate Speech"):
+        try:
+            if by_sentence:
+                sentences = [s for s in SENTENCE_END.split(text_input.strip()) if s]
+                asyncio.run(pipeline(sentences, voice_map[selected], model, output_format))
+            else:
+                play_audio(text_input, voice_map[selected], model, output_format)
+
+        except Exception as e:
+            st.error(f"Error generating audio: {e}")
+    elif st.session_state.get("last_audio"):
+        # Keep the last clips on screen across reruns
+        cache = _audio_cache()
+        keys = st.session_state["last_audio"]
+        for part, key in enumerate(keys, start=1):
+            audio_bytes = cache.get(key)
+            if audio_bytes is not None:
+                render_clip(audio_bytes, key[3], part=part if len(keys) > 1 else None)
+
 
 st.set_page_config(page_title="🎙️ Voice Agent Platform", layout="wide")
 st.title("🎙️ Open Voice Agent Platform")
@@ -16,6 +263,10 @@ menu = st.sidebar.radio(
     "Navigation", 
     ["Home", "Voices", "Create Agent", "Deploy Agent"]
 )
+quality = st.sidebar.selectbox("Quality", list(MODELS.keys()))
+output_format = st.sidebar.selectbox("Output format", list(OUTPUT_FORMATS.keys()))
+if st.sidebar.button("Refresh voices"):
+    list_voices.clear()
 
 # ---------------------------------------------------------
 # HOME
@@ -39,12 +290,11 @@ elif menu == "Voices":
     st.subheader("Available Voices")
 
     try:
-        all_voices = client.voices.get_all()
-        if not all_voices.voices:
+        voices = list_voices()
+        if not voices:
             st.info("No voices found.")
         else:
-            for v in all_voices.voices:
-                st.markdown(f"**{v.name}**  \nID: `{v.voice_id}`  \nCategory: {v.category}")
+            render_voices_panel(voices)
     except Exception as e:
         st.error(f"Error fetching voices: {e}")
 
@@ -65,19 +315,14 @@ elif menu == "Create Agent":
             st.warning("Please upload a sample file.")
         else:
             try:
-                # Save upload to a temp file
-                with tempfile.NamedTemporaryFile(delete=False) as tmp:
-                    tmp.write(uploaded_file.read())
-                    tmp.flush()
-                    with open(tmp.name, "rb") as f:
-                        resp = client.voices.add(
-                            name=agent_name,
-                            description=agent_desc,
-                            files=[f]
-                        )
-                    st.success("✅ Agent created successfully")
-                    st.json(resp.model_dump())
-                    os.remove(tmp.name)
+                resp = client.voices.add(
+                    name=agent_name,
+                    description=agent_desc,
+                    files=[prepare_sample(uploaded_file)]
+                )
+                list_voices.clear()
+                st.success("✅ Agent created successfully")
+                st.json(resp.model_dump())
             except Exception as e:
                 st.error(f"Error creating agent: {e}")
 
@@ -88,33 +333,12 @@ elif menu == "Deploy Agent":
     st.subheader("Deploy & Test Agent")
 
     try:
-        all_voices = client.voices.get_all()
-        if not all_voices.voices:
+        voices = list_voices()
+        if not voices:
             st.info("No voices available. Create one first.")
         else:
-            voice_map = {v.name: v.voice_id for v in all_voices.voices}
-            selected = st.selectbox("Choose Agent Voice", list(voice_map.keys()))
-            text_input = st.text_area("Agent Script", "Hello! I am your AI agent.")
-
-            if st.button("Generate Speech"):
-                try:
-                    audio = client.text_to_speech.convert(
-                        voice_id=voice_map[selected],
-                        model_id="eleven_multilingual_v2",
-                        text=text_input
-                    )
-
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
-                        for chunk in audio:
-                            tmp.write(chunk)
-                        tmp.flush()
-
-                        # Play back the audio
-                        st.audio(tmp.name, format="audio/mp3")
-                        os.remove(tmp.name)
-
-                except Exception as e:
-                    st.error(f"Error generating audio: {e}")
+            voice_map = {v["name"]: v["voice_id"] for v in voices}
+            render_deploy_panel(voice_map, MODELS[quality], OUTPUT_FORMATS[output_format])
 
     except Exception as e:
         st.error(f"Error loading voices: {e}")